@@ -3,106 +3,292 @@
 Program dedicated to tracking and creating backup files
 Created: 2018-07-30
 """
-from datetime import datetime
-from os import listdir, mkdir
-from posixpath import isdir, getmtime
-from subprocess import Popen, PIPE
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from errno import EMLINK, ENOTSUP, EPERM
+from glob import escape, glob
+from json import dump, load
+from os import cpu_count, link, lstat, makedirs, mkdir, remove, replace, scandir
+from posixpath import basename, isdir, isfile
+from shlex import join as join_command
+from shutil import copyfile, rmtree, which
+from subprocess import run
 from sys import argv
 
 READ = 'r'
 WRITE = 'w'
 BACKUP_INI = 'backup.ini'
+BACKUP_STATE = '.backup_state'
+INCREMENTAL_TARBALLS = 6  # Incremental tarballs on top of a full tarball, after that a modified folder starts over
+
+# Section headers in backup.ini and their section numbers
+SECTIONS = {
+    '[Backup date]': 1,
+    '[Base folders]': 2,
+    '[Backup folder]': 3,
+    '[Always]': 4,
+    '[Excluded]': 5,
+    '[Normal]': 6,
+    '[Individual files]': 7,
+    '[Compressor]': 8,
+}
+# Sections with one folder or file per line and the Backup list they fill
+SECTION_LISTS = {
+    2: 'base_folders',
+    4: 'always',
+    5: 'excluded',
+    6: 'normal',
+    7: 'individual',
+}
+# Tarball extension per compression program, other programs use their own name
+COMPRESSED_EXTENSIONS = {
+    'bzip2': 'bz2',
+    'gzip': 'gz',
+    'lbzip2': 'bz2',
+    'pbzip2': 'bz2',
+    'pigz': 'gz',
+    'pixz': 'xz',
+    'pzstd': 'zst',
+    'xz': 'xz',
+    'zstd': 'zst',
+}
+# Compression programs that use all cores by themselves, like zstd and xz with -T
+PARALLEL_COMPRESSORS = {'lbzip2', 'pbzip2', 'pigz', 'pixz', 'pzstd'}
+PARALLEL_TARBALLS = 2  # Tarballs made side by side with a parallel compressor
 
 
 class PipeError(Exception):
     pass
 
 
-def pipe(command):
-    with Popen(command, stdout=PIPE, stderr=PIPE, shell=True) as proc:
-        err = proc.stderr.read().decode()
-        # out = proc.stdout.read().decode()
-        # print(f"Out: {out}")
-        if err:
-            if "Removing leading `/' from member names" not in err:
-                print(f"Error executing command: {command}")
-                raise PipeError(err)
+def pipe(command, data=None):
+    # Capture both pipes, so a chatty command can't fill one and block forever
+    # The command is an argument list, no shell is started to parse it
+    proc = run(command, input=data, capture_output=True)
+    # out = proc.stdout.decode()
+    # print(f"Out: {out}")
+
+    # A failed command exits with an error code, stderr alone may just hold warnings, like tar's:
+    #   Removing leading `/' from member names
+    if proc.returncode:
+        print(f"Error executing command: {join_command(command)}")
+        raise PipeError(proc.stderr.decode())
+
+
+def run_parallel(function, arguments, max_workers):
+    # Every tarball is independent of the others, so make them side by side
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(function, *args) for args in arguments]
+        for future in as_completed(futures):
+            # Re-raise a PipeError from a worker in the main process
+            future.result()
+
+
+def tarball_name(path):
+    # Full name to guarantee no file is overwritten
+    backup_file_name = path.replace('/', '')
+    return backup_file_name.replace('.', '')
+
+
+def tarball_extension(compressor):
+    # The compressor may have options, for instance: zstd -T0
+    program = basename(compressor.split()[0])
+    return f'tar.{COMPRESSED_EXTENSIONS.get(program, program)}'
+
+
+def compressor_workers(compressor):
+    # A parallel compressor keeps all cores busy by itself, more tarballs at once only compete for the cores and disk
+    program, *options = compressor.split()
+    threads = [option for option in options if option.startswith(('-T', '--threads'))]
+    if basename(program) in PARALLEL_COMPRESSORS or (threads and threads[-1] not in ('-T1', '--threads=1')):
+        return PARALLEL_TARBALLS
+    # A single threaded compressor, one tarball per core
+    return cpu_count()
+
+
+def tar_create(tarball, compressor):
+    # tar compresses through the external program, which may use all cores
+    return ['tar', '--use-compress-program', compressor, '-cf', tarball]
+
+
+def link_file(source, target):
+    # Drives without hard links (FAT, exFAT, some network mounts) get a copy of the file
+    try:
+        link(source, target)
+    except OSError as err:
+        if err.errno not in (EMLINK, ENOTSUP, EPERM):
+            raise
+        copyfile(source, target)
+
+
+def backup_folder(path, backup, this_backup_folder, last_backup_folder, modified, compressor, timestamp,
+                  incremental_tarballs, verbose):
+    # tar --listed-incremental=/backup/date/name.snar -czf /backup/date/name.timestamp.tar.gz /path/origin
+    #   Only the files changed since the snapshot are added to the new tarball
+    #   The snapshot stays with its tarballs, so the backup folder in backup.ini always holds a matching pair
+    backup_file_name = tarball_name(path)
+    last_snapshot = f'{backup}/{last_backup_folder}/{backup_file_name}.snar'
+    snapshot = f'{backup}/{this_backup_folder}/{backup_file_name}.snar'
+
+    # The full tarball and the incremental tarballs on top of it, whatever compressor made them
+    tarballs = []
+    if last_backup_folder and isfile(last_snapshot):
+        tarballs = glob(f'{escape(f"{backup}/{last_backup_folder}/{backup_file_name}")}.*.tar.*')
+
+    # After enough incremental tarballs, start over with a full tarball, the old tarballs are left behind
+    #   On the same day, they are in this backup folder and are removed once the full tarball is made
+    outdated = []
+    if modified and len(tarballs) > incremental_tarballs:
+        if last_backup_folder == this_backup_folder:
+            outdated = tarballs
+        tarballs = []
+
+    if tarballs:
+        # Hard link the tarballs into the next backup_folder, the last backup folder stays complete as well
+        #   An unmodified folder links the snapshot along, the tarballs and their snapshot always go together
+        if last_backup_folder != this_backup_folder:
+            for tarball in tarballs if modified else tarballs + [last_snapshot]:
+                local_file = f'{backup}/{this_backup_folder}/{basename(tarball)}'
+                if verbose:
+                    print(join_command(['ln', tarball, local_file]))
+                    continue
+
+                try:
+                    link_file(tarball, local_file)
+                except OSError as err:
+                    print(f"Error linking: {tarball}")
+                    raise PipeError(err)
+
+        # If the folder was not modified, the tarballs are complete
+        if not modified:
+            return
+
+        # tar rewrites the snapshot, so it works on a copy, never on a linked file
+        #   A failed backup leaves the snapshot of the last backup folder untouched
+        if verbose:
+            print(join_command(['cp', last_snapshot, f'{snapshot}.new']))
+        else:
+            copyfile(last_snapshot, f'{snapshot}.new')
+        level = []
+    else:
+        # Without the tarballs to build on (or too many of them), start over with a full tarball
+        level = ['--level=0']
+
+    # If the folder was modified since the last backup, create a new incremental tarball
+    tarball = f'{backup}/{this_backup_folder}/{backup_file_name}.{timestamp}.{tarball_extension(compressor)}'
+    command = tar_create(tarball, compressor) + [f'--listed-incremental={snapshot}.new', *level, path]
+    if verbose:
+        print(join_command(command))
+        return
+
+    # Never write over a tarball, it is part of the chain (and may be linked into the last backup folder)
+    if isfile(tarball):
+        if isfile(f'{snapshot}.new'):
+            remove(f'{snapshot}.new')
+        raise PipeError(f'Tarball already exists: {tarball}')
+
+    try:
+        pipe(command)
+    except PipeError:
+        # Don't leave a partial tarball behind, it would be taken for part of the chain
+        for local_file in (tarball, f'{snapshot}.new'):
+            if isfile(local_file):
+                remove(local_file)
+        raise
+
+    # The new snapshot matches the tarballs in this backup folder
+    replace(f'{snapshot}.new', snapshot)
+    for tarball in outdated:
+        remove(tarball)
+
+
+def make_tarball(path, backup, this_backup_folder, compressor, verbose):
+    backup_file_name = tarball_name(path)
+
+    if verbose:
+        print('Make tarball')
+    local_files = []
+    with scandir(path) as entries:
+        for entry in entries:
+            if verbose:
+                print(entry.path)
+            if not entry.is_dir() and '.' != entry.name[0]:
+                local_files.append(entry.path)
+
+    # Only execute tar if there are files to prevent errors
+    if not local_files:
+        if verbose:
+            print('No tarball made')
+        return
+
+    # Make the tarball in one go, tar reads the NUL separated file list from stdin
+    command = tar_create(f'{backup}/{this_backup_folder}/{backup_file_name}.{tarball_extension(compressor)}',
+                         compressor) + ['--null', '-T', '-']
+    if verbose:
+        print(join_command(command))
+    else:
+        pipe(command, '\0'.join(local_files).encode())
+
+    if verbose:
+        print('FIN Make tarball')
 
 
 class Backup:
     def __init__(self, verbose_member=False):
         self.always = []                # Folders that will always be backed up
         self.backup = None              # Backup folder (where the backups will be saved)
+        self.backup_entries = set()     # Folders under the backup folder, read once
         self.base_folders = []          # Base folder to be checked to see if backup is needed
         self.checked = False            # If there are new folders found under the base folders, this will be True
+        self.compressor = None          # Program that compresses the tarballs (pigz if installed, else gzip)
         self.excluded = []              # Folders that will never be backed up
+        self.folder_times = {}          # Per normal folder, the modified time of all its folders at the last check
+        self.incremental_tarballs = INCREMENTAL_TARBALLS  # Incremental tarballs before starting over with a full one
         self.individual = []            # Individual files to be backed up, not under the base folders
         self.last_backup_folder = None  # Folder under the backup folder, with the date of the last backup
         self.last_date = None           # Date of the last backup (or None)
+        self.last_time = None           # Date of the last backup as a UTC timestamp (or None)
         self.modified = False           # If a folder under the base folder has been modified, a backup is needed
         self.normal = []                # The folders that will be backed up if needed (moved, if not)
         # Folder under the backup folder, with the date of the last backup
         self.this_backup_folder = datetime.today().strftime("%Y%m%d")
         self.verbose = verbose_member   # If verbose, no commands will be executed, they will be displayed
 
+        # Folder times of the last run, {path: {folder: modified time}}
+        #   A missing or broken state file only means walking all folders
+        try:
+            with open(BACKUP_STATE, READ) as file:
+                folder_times = load(file)
+            if isinstance(folder_times, dict):
+                self.folder_times = {path: times for path, times in folder_times.items() if isinstance(times, dict)}
+        except (OSError, ValueError):
+            pass
+
         section = 0
         try:
-            # Open the .ini file
+            # Open the .ini file, read it at once and split it without the line endings
             with open(BACKUP_INI, READ) as file:
-                for line in file:
-                    # Check section we're in
-                    if '[Backup date]' in line:
-                        section = 1
-                        continue
-                    elif '[Base folders]' in line:
-                        section = 2
-                        continue
-                    elif '[Backup folder]' in line:
-                        section = 3
-                        continue
-                    elif '[Always]' in line:
-                        section = 4
-                        continue
-                    elif '[Excluded]' in line:
-                        section = 5
+                for line in file.read().splitlines():
+                    # Check section we're in, a hand-edited header may have spaces or a comment after it
+                    header = line.partition('#')[0].strip()
+                    if header in SECTIONS:
+                        section = SECTIONS[header]
                         continue
-                    elif '[Normal]' in line:
-                        section = 6
-                        continue
-                    elif '[Individual files]' in line:
-                        section = 7
-                        continue
-                    elif '#' == line[0] or '\n' == line:
+                    elif not line or '#' == line[0]:
                         continue
 
-                    if 1 == section:
-                        self.last_date = datetime.strptime(line[:-1], "%Y%m%d")
-                        self.last_backup_folder = line[:-1]
-                    elif 2 == section:
-                        self.base_folders.append(line[:-1])
+                    # The folder and file sections are lists of lines
+                    if section in SECTION_LISTS:
+                        getattr(self, SECTION_LISTS[section]).append(line)
+                    elif 1 == section:
+                        self.last_date = datetime.strptime(line, "%Y%m%d")
+                        # The modified times are compared in UTC, as floats
+                        self.last_time = self.last_date.replace(tzinfo=timezone.utc).timestamp()
+                        self.last_backup_folder = line
                     elif 3 == section:
-                        self.backup = line[:-1]
-
-                        # Check if the backup folder exists
-                        #   If it doesn't exist, create it
-                        if not isdir(self.backup):
-                            command = f'Creating backup folder: {self.backup}'
-                            if self.verbose:
-                                print(command)
-                            else:
-                                mkdir(self.backup)
-                        else:
-                            # Clean-up the backup drive
-                            # Remove outdated backup folders
-                            self.cleanup_drive()
-                    elif 4 == section:
-                        self.always.append(line[:-1])
-                    elif 5 == section:
-                        self.excluded.append(line[:-1])
-                    elif 6 == section:
-                        self.normal.append(line[:-1])
-                    elif 7 == section:
-                        self.individual.append(line[:-1])
+                        self.backup = line
+                    elif 8 == section:
+                        self.compressor = line
 
         except FileNotFoundError:
             # always, excluded & normal are empty
@@ -112,6 +298,32 @@ class Backup:
         if not self.backup:
             self._exit('Please indicate the backup folder in the backup.ini file.')
 
+        # Create the backup folder, if it doesn't exist
+        #   Not its parents, if the backup drive isn't mounted, the backup must not go to the root file system
+        if not self.verbose:
+            try:
+                mkdir(self.backup)
+            except FileExistsError:
+                pass
+            except OSError as err:
+                print(f"Error creating backup folder: {self.backup}")
+                # Prevent __del__ from making a new backup.ini file
+                self.verbose = True
+                raise PipeError(err)
+        elif not isdir(self.backup):
+            # Nothing to clean-up either
+            print(f'Creating backup folder: {self.backup}')
+            return
+
+        # Read the backup folder once, cleanup_drive and go() look up its folders in the set
+        #   Symbolic links to folders are not backup folders, they are left alone
+        with scandir(self.backup) as entries:
+            self.backup_entries = {entry.name for entry in entries if entry.is_dir(follow_symlinks=False)}
+
+        # Clean-up the backup drive
+        # Remove outdated backup folders
+        self.cleanup_drive()
+
     def __del__(self):
         # If there are new folders found, this will be True
         if self.checked:
@@ -122,78 +334,122 @@ class Backup:
             return
 
         # Set the current date for the next backup
+        #   Build the whole file first and write it at once
+        lines = ['[Backup date]\n',
+                 '# Date (YYYYMMDD) since the last backup empty if for first backup.\n']
+        if self.this_backup_folder:
+            lines.append(f'{self.this_backup_folder}\n')
+        lines.append('\n')
+
+        lines += ['[Base folders]\n',
+                  '# These are the top most folders. Subfolders will be analyzed.\n',
+                  '# Base folders are not backed up themselves.\n']
+        lines += [f'{line}\n' for line in self.base_folders]
+        lines.append('\n')
+
+        lines += ['[Backup folder]\n',
+                  '# This is where the backup will be saved.\n']
+        if self.backup:
+            lines.append(f'{self.backup}\n')
+        lines.append('\n')
+
+        lines += ['[Compressor]\n',
+                  '# Program that compresses the tarballs, for instance: gzip, pigz or zstd -T0\n',
+                  '#   Empty for pigz (parallel gzip) if it is installed, gzip otherwise.\n']
+        if self.compressor:
+            lines.append(f'{self.compressor}\n')
+        lines.append('\n')
+
+        lines += ['[Always]\n',
+                  '# Folders that are always backed up because the content changes anyway.\n']
+        lines += [f'{line}\n' for line in self.always]
+        lines.append('\n')
+
+        lines += ['[Excluded]\n',
+                  '# Folders that are never backed up because you don\'t want to back them up.\n']
+        lines += [f'{line}\n' for line in self.excluded]
+        lines.append('\n')
+
+        lines += ['[Normal]\n',
+                  '# Folders that are checked before back-up.\n',
+                  '#   If the folder has been modified, it will be backed up.\n',
+                  '#   Otherwise, its tarballs will be linked into the new backup.\n']
+        lines += [f'{line}\n' for line in self.normal]
+        lines.append('\n')
+
+        lines += ['[Individual files]\n',
+                  '# Files that you would like to back-up, but are not in any folder you would like to back-up.\n',
+                  '#     For instance /etc/hosts\n',
+                  '#     The program has no means of discovering these files, so add them ... individually.\n']
+        lines += [f'{line}\n' for line in self.individual]
+
         with open(BACKUP_INI, WRITE) as file:
-            file.write('[Backup date]\n')
-            file.write('# Date (YYYYMMDD) since the last backup empty if for first backup.\n')
-            if self.this_backup_folder:
-                file.write(f'{self.this_backup_folder}\n')
-            file.write('\n')
-
-            file.write('[Base folders]\n')
-            file.write('# These are the top most folders. Subfolders will be analyzed.\n')
-            file.write('# Base folders are not backed up themselves.\n')
-            for line in self.base_folders:
-                file.write(f'{line}\n')
-            file.write('\n')
-
-            file.write('[Backup folder]\n')
-            file.write('# This is where the backup will be saved.\n')
-            if self.backup:
-                file.write(f'{self.backup}\n')
-            file.write('\n')
-
-            file.write('[Always]\n')
-            file.write('# Folders that are always backed up because the content changes anyway.\n')
-            for line in self.always:
-                file.write(f'{line}\n')
-            file.write('\n')
-
-            file.write('[Excluded]\n')
-            file.write('# Folders that are never backed up because you don\'t want to back them up.\n')
-            for line in self.excluded:
-                file.write(f'{line}\n')
-            file.write('\n')
-
-            file.write('[Normal]\n')
-            file.write('# Folders that are checked before back-up.\n')
-            file.write('#   If the folder has been modified, it will be backed up.\n')
-            file.write('#   Otherwise, the folder will be moved to the new backup.\n')
-            for line in self.normal:
-                file.write(f'{line}\n')
-            file.write('\n')
-
-            file.write('[Individual files]\n')
-            file.write('# Files that you would like to back-up, but are not in any folder you would like to back-up.\n')
-            file.write('#     For instance /etc/hosts\n')
-            file.write('#     The program has no means of discovering these files, so add them ... individually.\n')
-            for line in self.individual:
-                file.write(f'{line}\n')
+            file.write(''.join(lines))
+
+        # Keep the folder times of the normal folders for the next backup
+        folder_times = {path: self.folder_times[path] for path in self.normal if path in self.folder_times}
+        with open(BACKUP_STATE, WRITE) as file:
+            dump(folder_times, file)
 
     def _check_folders(self, path):
         # The goal is to find out if there was a modification
-        if self.modified:
+        # If there is no last backup
+        if self.last_time is None:
+            self.modified = True
             return
 
-        # Recursive check the last modified date
-        for local_path in listdir(path):
-            local_file = f'{path}/{local_path}'
-            if isdir(local_file):
-                # If there is no last backup
-                if not self.last_date:
-                    self.modified = True
-                    return
+        # Start with the folder itself, one stat finds a file or folder added, removed or renamed in it
+        folder_time = lstat(path).st_mtime
+        if folder_time > self.last_time:
+            self.modified = True
+            self.folder_times.pop(path, None)
+            return
 
-                modified_date = datetime.utcfromtimestamp(getmtime(local_file))
-                if modified_date > self.last_date:
-                    self.modified = True
-                    return
+        # If no folder was added, removed or renamed since the last check, the folder times of the last
+        # check are still complete. Stat'ing those folders is enough, no folder has to be read.
+        folder_times = self.folder_times.get(path)
+        if folder_times and self._unchanged(folder_times):
+            self.modified = any(modified_time > self.last_time for modified_time in folder_times.values())
+            return
 
-                # print(local_file)
-                self._check_folders(local_file)
+        # Walk the folders iteratively and stop at the first modified one
+        #   The scandir entries come with their full path, no path has to be joined
+        folder_times = {path: folder_time}
+        folders = [path]
+        while folders:
+            try:
+                entries = scandir(folders.pop())
+            except OSError:
+                # Like os.walk, skip folders that can't be read
+                continue
+
+            with entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
 
-        # If there is no last backup
-        if not self.last_date:
-            self.modified = True
+                    modified_time = entry.stat(follow_symlinks=False).st_mtime
+                    if modified_time > self.last_time:
+                        self.modified = True
+                        # The folder times are incomplete
+                        self.folder_times.pop(path, None)
+                        return
+
+                    folder_times[entry.path] = modified_time
+                    folders.append(entry.path)
+
+        self.folder_times[path] = folder_times
+
+    @staticmethod
+    def _unchanged(folder_times):
+        # A folder's modified time changes when a file or folder is added, removed or renamed in it
+        for folder, modified_time in folder_times.items():
+            try:
+                if lstat(folder).st_mtime != modified_time:
+                    return False
+            except OSError:
+                return False
+        return True
 
     def go(self):
         print('Checking for new folders.')
@@ -202,84 +458,76 @@ class Backup:
             return
 
         local_path = f'{self.backup}/{self.this_backup_folder}'
-        if not isdir(local_path):
-            command = f'Create current backup folder: {local_path})'
+        if self.this_backup_folder not in self.backup_entries:
             if self.verbose:
-                print(command)
+                print(f'Create current backup folder: {local_path}')
             else:
-                mkdir(local_path)
+                makedirs(local_path, exist_ok=True)
+                self.backup_entries.add(self.this_backup_folder)
+
+        # Incremental tarballs sort by the time they were made, in UTC to keep that order over DST changes
+        #   Down to the microsecond, so runs within the same second don't share a tarball name
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
+
+        # pigz makes the same .gz files as gzip, using all cores
+        compressor = self.compressor or ('pigz' if which('pigz') else 'gzip')
+        workers = compressor_workers(compressor)
 
         # Backup files in base folders
         print('Backup files in base folders.')
-        for local_path in self.base_folders:
-            self._make_tarball(local_path)
+        run_parallel(make_tarball, [(local_path, self.backup, self.this_backup_folder, compressor, self.verbose)
+                                    for local_path in self.base_folders], workers)
 
         # Always backup
-        print('Backup folders that should always be backed up.')
-        self.modified = True
-        for local_path in self.always:
-            self._backup(local_path)
+        tarballs = [(local_path, True) for local_path in self.always]
 
         # Normal folders, check if they're modified
-        #   If they're not modified, move to new backup folder
-        #   If they are modified, create new backup tarball
-        print('Backup modified folders.')
+        #   If they're not modified, link their tarballs into the new backup folder
+        #   If they are modified, add an incremental tarball with the changed files
+        print('Checking for modified folders.')
         for local_path in self.normal:
             self.modified = False
             self._check_folders(local_path)
-            self._backup(local_path)
+            tarballs.append((local_path, self.modified))
+
+        print('Backup folders that should always be backed up and modified folders.')
+        run_parallel(backup_folder, [(local_path, self.backup, self.this_backup_folder, self.last_backup_folder,
+                                      modified, compressor, timestamp, self.incremental_tarballs, self.verbose)
+                                     for local_path, modified in tarballs], workers)
 
         # Individual files
         print('Backup individual files.')
-        for local_file in self.individual:
-            command = f'tar -rf "{self.backup}/{self.this_backup_folder}/individual.tar" "{local_file}"'
+        if self.individual:
+            tarball = f'{self.backup}/{self.this_backup_folder}/individual.{tarball_extension(compressor)}'
+            command = tar_create(tarball, compressor) + ['--null', '-T', '-']
             if self.verbose:
-                print(command)
+                print(join_command(command))
             else:
-                pipe(command)
-
-        command = f'gzip -c "{self.backup}/{self.this_backup_folder}/individual.tar" > ' \
-                  f'"{self.backup}/{self.this_backup_folder}/individual.tar.gz"'
-        if self.verbose:
-            print(command)
-        else:
-            pipe(command)
-
-        command = f'rm "{self.backup}/{self.this_backup_folder}/individual.tar"'
-        if self.verbose:
-            print(command)
-        else:
-            pipe(command)
+                pipe(command, '\0'.join(self.individual).encode())
 
     def _check_new(self):
         # Below these base folders are "always", "excluded" and "normal" folders
         # Keep the newly found folders to show later
         new = []
 
+        # One set lookup per folder instead of searching three lists
+        known = frozenset(self.always) | frozenset(self.excluded) | frozenset(self.normal)
+
         # Go through all base folders
         for path in self.base_folders:
             # Get the files and folders from the base folder
-            for local_path in listdir(path):
-                # Make a local path to check, only one level down
-                local_folder = f'{path}/{local_path}'
-
-                # If it is a folder
-                if not isdir(local_folder):
-                    continue
-
-                # Check that the folder is now known
-                if local_folder in self.always:
-                    continue
-
-                # Not excluded
-                if local_folder in self.excluded:
-                    continue
+            with scandir(path) as entries:
+                for entry in entries:
+                    # If it is a folder, only one level down
+                    if not entry.is_dir():
+                        continue
+                    local_folder = entry.path
 
-                # Definitely not known
-                if local_folder in self.normal:
-                    continue
+                    # Check that the folder is not known ("always", "excluded" or "normal")
+                    if local_folder in known:
+                        continue
 
-                new.append(local_folder)
+                    new.append(local_folder)
 
         # New folders detected
         if new:
@@ -288,83 +536,12 @@ class Backup:
             for line in new:
                 print(line)
 
-    def _backup(self, path):
-        # tar -czvf /path/destine.tar.gz /path/origin
-        # Full name to guarantee no file is overwritten
-        backup_file_name = path.replace('/', '')
-        backup_file_name = backup_file_name.replace('.', '')
-
-        # If the folder was modified since the last backup, create a new tarball
-        if self.modified:
-            command = f'tar -czf "{self.backup}/{self.this_backup_folder}/{backup_file_name}.tar.gz" "{path}"'
-            if self.verbose:
-                print(command)
-            else:
-                pipe(command)
-
-        else:
-            # If the folder was not modified, just move the tarball to the next backup_folder
-            if self.last_backup_folder \
-             and self.last_backup_folder != self.this_backup_folder:
-                command = f'mv "{self.backup}/{self.last_backup_folder}/{backup_file_name}.tar.gz" ' \
-                          f'"{self.backup}/{self.this_backup_folder}/"'
-                if self.verbose:
-                    print(command)
-                else:
-                    pipe(command)
-
-    def _make_tarball(self, path):
-        # Only execute gzip if there is a tar file to prevent errors
-        b_no_tar = True
-
-        # Full name to guarantee no file is overwritten
-        backup_file_name = path.replace('/', '')
-        backup_file_name = backup_file_name.replace('.', '')
-
-        if self.verbose:
-            print('Make tarball')
-        for local_path in listdir(path):
-            local_file = f'{path}/{local_path}'
-            if self.verbose:
-                print(local_file)
-            if not isdir(local_file) and '.' != local_path[0]:
-                # Make a local path to add to the tar file
-                command = f'tar -rf "{self.backup}/{self.this_backup_folder}/{backup_file_name}.tar" "{local_file}"'
-                b_no_tar = False
-                if self.verbose:
-                    print(command)
-                else:
-                    pipe(command)
-
-        # Only execute gzip if there is a tar file to prevent errors
-        if b_no_tar:
-            if self.verbose:
-                print('No tarball made')
-            return
-
-        # Make the tarball
-        command = f'gzip -c "{self.backup}/{self.this_backup_folder}/{backup_file_name}.tar" > ' \
-                  f'"{self.backup}/{self.this_backup_folder}/{backup_file_name}.tar.gz"'
-        if self.verbose:
-            print(command)
-        else:
-            pipe(command)
-
-        # Remove the tar file
-        command = f'rm "{self.backup}/{self.this_backup_folder}/{backup_file_name}.tar"'
-        if self.verbose:
-            print(command)
-        else:
-            pipe(command)
-
-        if self.verbose:
-            print('FIN Make tarball')
-
     def _exit(self, message):
         self.backup = None              # Backup folder (where the backups will be saved)
         self.checked = False            # If there are new folders found under the base folders, this will be True
         self.last_backup_folder = None  # Folder under the backup folder, with the date of the last backup
         self.last_date = None           # Date of the last backup (or None)
+        self.last_time = None           # Date of the last backup as a UTC timestamp (or None)
         self.modified = False           # If a folder under the base folder has been modified, a backup is needed
         self.verbose = False            # If verbose, no commands will be executed, they will be displayed
         self.this_backup_folder = None  # Folder under the backup folder, with the date of the last backup
@@ -373,13 +550,24 @@ class Backup:
 
     def cleanup_drive(self):
         # Delete all folders except 'laptop' and self.last_backup_folder
-        path = self.backup
-        for local_path in listdir(path):
-            local_file = f'{path}/{local_path}'
-            if isdir(local_file):
-                if local_path != self.last_backup_folder and local_path != 'laptop':
-                    command = f'rm -r "{local_file}"'
-                    pipe(command)
+        outdated = [local_path for local_path in self.backup_entries
+                    if local_path not in (self.last_backup_folder, 'laptop')]
+
+        if self.verbose:
+            for local_path in outdated:
+                print(f'Removing outdated backup folder: {self.backup}/{local_path}')
+            return
+
+        # Removing folders is mostly waiting for the file system, so remove them side by side
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(rmtree, [f'{self.backup}/{local_path}' for local_path in outdated]))
+        except OSError as err:
+            print(f"Error removing outdated backup folders in: {self.backup}")
+            # Called from __init__, prevent __del__ from making a new backup.ini file
+            self.verbose = True
+            raise PipeError(err)
+        self.backup_entries.difference_update(outdated)
 
 
 if __name__ == '__main__':
@@ -393,12 +581,14 @@ if __name__ == '__main__':
             print("Verbose on")
             verbose = True
 
-    backup = Backup(verbose)
+    backup = None
     try:
+        backup = Backup(verbose)
         backup.go()
     except PipeError as err:
         # Prevent __del__ from making a new backup.ini file
-        backup.verbose = True
+        if backup:
+            backup.verbose = True
         print(err)
 
     # If not verbose and no new folders found, make a new backup.ini file with the current date
@@ -6,6 +6,12 @@
 # To run the backup utility, use without -v
 python3 backup.py
 
+# Always and normal folders are saved as a full tarball followed by incremental tarballs
+# To restore such a folder, extract its tarballs from the last backup folder in order, the full tarball first
+#for f in /home/user/mybackup/YYYYMMDD/homeuserfolder.*.tar.*; do tar --listed-incremental=/dev/null -xf "$f" -C /; done
+# The folder's tar snapshot (homeuserfolder.snar) is kept next to its tarballs
+# After 6 incremental tarballs, a modified folder starts over with a full tarball (INCREMENTAL_TARBALLS)
+
 # When new folders are found below the base folders (first level only)
 # The program prints the folders.
 # The user can copy these folders to different sections within the backup.ini file
@@ -19,7 +25,7 @@ python3 backup.py
 # [Normal]
 # Folders that are checked before back-up.
 #   If the folder has been modified, it will be backed up.
-#   Otherwise, the folder will be moved to the new backup.
+#   Otherwise, its tarballs will be linked into the new backup.
 
 # [Individual files]
 # Files that you would like to back-up, but are not in any folder you would like to back-up.
@@ -0,0 +1,230 @@
+"""
+Tests for the backup utility, they run real backups in a temporary folder
+"""
+from errno import EPERM
+from contextlib import nullcontext
+from glob import glob
+from json import load
+from os import chdir, cpu_count, getcwd, makedirs, rename, symlink, utime
+from posixpath import basename, isdir, islink
+from subprocess import run
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from backup import (BACKUP_INI, BACKUP_STATE, INCREMENTAL_TARBALLS, PARALLEL_TARBALLS, Backup, PipeError, backup_folder,
+                    compressor_workers, tarball_name)
+
+OLD_TIME = 946684800  # 2000-01-01, before the last backup on 2000-01-02
+
+
+class BackupTest(TestCase):
+    def setUp(self):
+        self.cwd = getcwd()
+        self.temp = TemporaryDirectory()
+        self.root = self.temp.name
+        self.base = f'{self.root}/base'
+        self.normal = f'{self.base}/norm'
+        self.backup = f'{self.root}/bk'
+        makedirs(f'{self.normal}/sub')
+        with open(f'{self.normal}/sub/x', 'w') as file:
+            file.write('x')
+        chdir(self.root)
+
+    def tearDown(self):
+        chdir(self.cwd)
+        self.temp.cleanup()
+
+    def write_ini(self, individual, backup_date=''):
+        with open(BACKUP_INI, 'w') as file:
+            file.write(f'[Backup date]\n{backup_date}\n\n'
+                       f'[Base folders]\n{self.base}\n\n'
+                       f'[Backup folder]\n{self.backup}\n\n'
+                       f'[Compressor]\ngzip\n\n'
+                       f'[Normal]\n{self.normal}\n\n'
+                       f'[Individual files]\n{individual}\n')
+
+    def run_backup(self, backup_date, incremental_tarballs=INCREMENTAL_TARBALLS):
+        # Like running backup.py on the given day, returns False if the backup failed
+        backup = Backup()
+        backup.this_backup_folder = backup_date
+        backup.incremental_tarballs = incremental_tarballs
+        try:
+            backup.go()
+        except PipeError:
+            # Prevent __del__ from making a new backup.ini file
+            backup.verbose = True
+            return False
+        finally:
+            del backup
+        return True
+
+    def check_normal(self, walk=True):
+        # Like go(), check the normal folder, returns if it was modified and its folder times in the state file
+        backup = Backup()
+        backup.this_backup_folder = '20000102'
+        with nullcontext() if walk else patch('backup.scandir', side_effect=AssertionError('Folders walked')):
+            backup._check_folders(self.normal)
+        modified = backup.modified
+        del backup
+        with open(BACKUP_STATE) as file:
+            return modified, load(file).get(self.normal)
+
+    def restore(self, backup_date):
+        # Extract the tarballs of the normal folder in order, as backup.sh describes
+        target = f'{self.root}/restore'
+        makedirs(target)
+        name = tarball_name(self.normal)
+        for tarball in sorted(glob(f'{self.backup}/{backup_date}/{name}.*.tar.*')):
+            run(['tar', '--listed-incremental=/dev/null', '-xf', tarball, '-C', target], check=True)
+        return f'{target}{self.normal}'
+
+    def test_failed_backup_keeps_changes_for_the_next_backup(self):
+        individual = f'{self.root}/hosts'
+        with open(individual, 'w') as file:
+            file.write('hosts')
+        self.write_ini(individual)
+        self.assertTrue(self.run_backup('20000101'))
+
+        # The normal folder changes, but the individual file is missing, so the backup fails
+        with open(f'{self.normal}/sub/newfile', 'w') as file:
+            file.write('new')
+        rename(individual, f'{individual}.away')
+        self.assertFalse(self.run_backup('20000102'))
+        with open(BACKUP_INI) as file:
+            self.assertIn('20000101', file.read())
+
+        # The next backup must still have the change
+        rename(f'{individual}.away', individual)
+        self.assertTrue(self.run_backup('20000103'))
+
+        restored = self.restore('20000103')
+        self.assertEqual(sorted(glob('**', root_dir=restored, recursive=True)), ['sub', 'sub/newfile', 'sub/x'])
+
+    def test_full_tarball_after_incremental_tarballs(self):
+        self.write_ini('')
+        name = tarball_name(self.normal)
+        # A full tarball, an incremental tarball and then a new full tarball
+        for backup_date in ('20000101', '20000102', '20000103'):
+            with open(f'{self.normal}/sub/{backup_date}', 'w') as file:
+                file.write(backup_date)
+            self.assertTrue(self.run_backup(backup_date, 1))
+
+        self.assertEqual(len(glob(f'{self.backup}/20000102/{name}.*.tar.*')), 2)
+        self.assertEqual(len(glob(f'{self.backup}/20000103/{name}.*.tar.*')), 1)
+        restored = self.restore('20000103')
+        self.assertEqual(sorted(glob('**', root_dir=restored, recursive=True)),
+                         ['sub', 'sub/20000101', 'sub/20000102', 'sub/20000103', 'sub/x'])
+
+    def test_same_timestamp_keeps_the_chain(self):
+        makedirs(f'{self.backup}/20000101')
+        backup_folder(self.normal, self.backup, '20000101', None, True, 'gzip', '1', INCREMENTAL_TARBALLS, False)
+        with open(f'{self.normal}/sub/y', 'w') as file:
+            file.write('y')
+        backup_folder(self.normal, self.backup, '20000101', '20000101', True, 'gzip', '2',
+                      INCREMENTAL_TARBALLS, False)
+
+        # A second tarball with the same name fails, instead of replacing the last tarball of the chain
+        with open(f'{self.normal}/sub/z', 'w') as file:
+            file.write('z')
+        with self.assertRaises(PipeError):
+            backup_folder(self.normal, self.backup, '20000101', '20000101', True, 'gzip', '2',
+                      INCREMENTAL_TARBALLS, False)
+
+        self.assertEqual(glob(f'{self.backup}/20000101/*.new'), [])
+        restored = self.restore('20000101')
+        self.assertEqual(sorted(glob('**', root_dir=restored, recursive=True)), ['sub', 'sub/x', 'sub/y'])
+
+    def test_copy_tarballs_without_hard_links(self):
+        makedirs(f'{self.backup}/20000101')
+        makedirs(f'{self.backup}/20000102')
+        backup_folder(self.normal, self.backup, '20000101', None, True, 'gzip', '1', INCREMENTAL_TARBALLS, False)
+
+        # Like a FAT drive, link() is not permitted
+        with patch('backup.link', side_effect=OSError(EPERM, 'Operation not permitted')):
+            backup_folder(self.normal, self.backup, '20000102', '20000101', False, 'gzip', '2',
+                          INCREMENTAL_TARBALLS, False)
+
+        name = tarball_name(self.normal)
+        self.assertEqual(sorted(basename(path) for path in glob(f'{self.backup}/20000102/*')),
+                         [f'{name}.1.tar.gz', f'{name}.snar'])
+        restored = self.restore('20000102')
+        self.assertEqual(sorted(glob('**', root_dir=restored, recursive=True)), ['sub', 'sub/x'])
+
+    def test_cleanup_leaves_symbolic_links_alone(self):
+        makedirs(f'{self.backup}/19990101')
+        makedirs(f'{self.root}/other')
+        symlink(f'{self.root}/other', f'{self.backup}/latest')
+        self.write_ini('')
+        self.assertTrue(self.run_backup('20000101'))
+
+        self.assertFalse(isdir(f'{self.backup}/19990101'))
+        self.assertTrue(islink(f'{self.backup}/latest'))
+        self.assertTrue(isdir(f'{self.root}/other'))
+
+    def test_missing_backup_drive(self):
+        # Like a backup folder on a drive that isn't mounted
+        self.backup = f'{self.root}/media/bk'
+        self.write_ini('')
+        with open(BACKUP_INI) as file:
+            ini = file.read()
+        with self.assertRaises(PipeError):
+            Backup()
+
+        self.assertFalse(isdir(f'{self.root}/media'))
+        with open(BACKUP_INI) as file:
+            self.assertEqual(file.read(), ini)
+
+    def test_folder_times_cache(self):
+        self.write_ini('', '20000102')
+        deep = f'{self.normal}/sub/deep'
+        makedirs(deep)
+        for folder in (deep, f'{self.normal}/sub', self.normal):
+            utime(folder, (OLD_TIME, OLD_TIME))
+        folder_times = {self.normal: OLD_TIME, f'{self.normal}/sub': OLD_TIME, deep: OLD_TIME}
+        self.assertEqual(self.check_normal(), (False, folder_times))
+
+        # Nothing changed, the cached folder times are enough
+        self.assertEqual(self.check_normal(walk=False), (False, folder_times))
+
+        # A new folder deep in the tree, its parents look unmodified, but the cache no longer matches
+        makedirs(f'{deep}/new')
+        utime(deep, (OLD_TIME + 1, OLD_TIME + 1))
+        self.assertEqual(self.check_normal(), (True, None))
+
+        utime(f'{deep}/new', (OLD_TIME, OLD_TIME))
+        folder_times.update({deep: OLD_TIME + 1, f'{deep}/new': OLD_TIME})
+        self.assertEqual(self.check_normal(), (False, folder_times))
+
+        # The folder itself is modified, the cache is dropped
+        with open(f'{self.normal}/y', 'w') as file:
+            file.write('y')
+        self.assertEqual(self.check_normal(), (True, None))
+
+    def test_broken_state_file(self):
+        self.write_ini('')
+        for state in ('garbage\n', '[1]', f'{{"{self.normal}": 1}}'):
+            with open(BACKUP_STATE, 'w') as file:
+                file.write(state)
+            backup = Backup()
+            backup.verbose = True
+            self.assertEqual(backup.folder_times, {})
+
+    def test_compressor_workers(self):
+        for compressor in ('pigz', '/usr/bin/pigz -9', 'zstd -T0', 'xz --threads=0'):
+            self.assertEqual(compressor_workers(compressor), PARALLEL_TARBALLS)
+        for compressor in ('gzip', 'zstd -19', 'xz -T1'):
+            self.assertEqual(compressor_workers(compressor), cpu_count())
+
+    def test_section_header_with_spaces_and_comment(self):
+        with open(BACKUP_INI, 'w') as file:
+            file.write(f'[Backup folder] \n{self.backup}\n\n'
+                       f'[Normal]  # Checked before back-up\n{self.normal}\n')
+        backup = Backup()
+        backup.verbose = True
+        self.assertEqual(backup.backup, self.backup)
+        self.assertEqual(backup.normal, [self.normal])
+
+
+if __name__ == '__main__':
+    main()